@@ -1,17 +1,14 @@
 """Main Streamlit chat application."""
 import streamlit as st
 import logging
-import os
+import time
 import database
 import groq
 from threading import Thread
-from langchain.memory import ConversationBufferWindowMemory
-from mental_health import analyze_sentiment, get_resources, format_sentiment_html
-from state_manager import StateManager
-from dotenv import load_dotenv
-
-# Load environment variables from .env file
-load_dotenv()
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from mental_health import analyze_sentiment, render_resources_markdown, format_sentiment_html
+from state_manager import StateManager, get_settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,58 +22,81 @@ StateManager.initialize_state()
 
 # Set API key from session state
 if "GROQ_API_KEY" not in st.session_state:
-    st.session_state.GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
+    st.session_state.GROQ_API_KEY = get_settings().groq_api_key
+
+# Streaming re-render throttle: redraw after this many new chars or seconds
+STREAM_UPDATE_CHARS = 32
+STREAM_UPDATE_INTERVAL = 0.05
 
-# Initialize memory dictionary
-if "memories" not in st.session_state:
-    st.session_state.memories = {}
+# Conversation context sent to the API: last 5 user/assistant exchanges
+CONTEXT_WINDOW_MESSAGES = 10
 
-def get_or_create_memory(chat_id):
-    """Retrieve or create memory for a specific chat session."""
+# Initialize API-ready context dictionary
+if "api_messages" not in st.session_state:
+    st.session_state.api_messages = {}
+
+def get_context_messages(chat_id):
+    """Retrieve or create the API message window for a specific chat session."""
     chat_id = chat_id or "default_chat"
-    if chat_id not in st.session_state.memories:
-        st.session_state.memories[chat_id] = ConversationBufferWindowMemory(k=5, return_messages=True, memory_key="chat_history")
-    return st.session_state.memories[chat_id]
+    return st.session_state.api_messages.setdefault(chat_id, [])
+
+def remember_message(chat_id, role, content):
+    """Append a message to the chat's context window, dropping the oldest beyond the limit."""
+    messages = get_context_messages(chat_id)
+    messages.append({"role": role, "content": content})
+    if len(messages) > CONTEXT_WINDOW_MESSAGES:
+        del messages[:-CONTEXT_WINDOW_MESSAGES]
 
 @st.cache_resource(show_spinner=False)
 def load_model():
     """Load AI model or use Groq API."""
     model_config = StateManager.get_current_model()
-    if model_config.get("api") == "groq":
+    if model_config.api == "groq":
         st.session_state.model_loaded = True
         return None, None
     return None, None  # Simplified: Actual model loading is handled elsewhere
 
+@st.cache_resource(show_spinner=False)
+def get_groq_client(api_key):
+    """Shared Groq client per API key so HTTP connections stay warm across turns."""
+    return groq.Client(api_key=api_key)
+
+MISSING_API_KEY_MESSAGE = ("GROQ_API_KEY is not set. Add `GROQ_API_KEY=your_groq_api_key_here` "
+                           "to a `.env` file in the project root and restart the app.")
+
+def get_model_unavailable_reason():
+    """Explain why the selected model can't be called, or return None if it can."""
+    if not st.session_state.GROQ_API_KEY:
+        return MISSING_API_KEY_MESSAGE
+    model_config = StateManager.get_current_model()
+    # Local models can't be served through the Groq client
+    if model_config.api != "groq":
+        return f"{model_config.key} is a local model, which the chat can't run yet. Choose a Groq model in Settings."
+    return None
+
 def generate_response_with_groq(prompt, chat_id=None):
     """Generate a response using Groq API with optimized streaming."""
     try:
-        client = groq.Client(api_key=st.session_state.GROQ_API_KEY)
+        client = get_groq_client(st.session_state.GROQ_API_KEY)
         
         # Get current personality
         personality = StateManager.get_current_personality()
         
-        # Get conversation memory
-        memory = get_or_create_memory(chat_id)
-        
-        # Prepare messages for the API
-        messages = []
+        # Get conversation context (already in API message format)
+        context = get_context_messages(chat_id)
         
-        # Add system message with personality
+        # Add system message with personality, then conversation history
         system_message = f"{personality['prompt']}\n\nYou have access to the conversation history and should use it to maintain context."
-        messages.append({"role": "system", "content": system_message})
+        messages = [{"role": "system", "content": system_message}, *context]
         
-        # Add conversation history
-        if memory.chat_memory.messages:
-            for msg in memory.chat_memory.messages:
-                role = "user" if msg.type == "human" else "assistant"
-                messages.append({"role": role, "content": msg.content})
-        
-        # Add the current user message
-        messages.append({"role": "user", "content": prompt})
+        # Add the current user message unless process_message already recorded it
+        current_message = {"role": "user", "content": prompt}
+        if not context or context[-1] != current_message:
+            messages.append(current_message)
         
         # Get the model configuration
         model_config = StateManager.get_current_model()
-        model_name = model_config.get("name", "llama3-8b-8192")
+        model_name = model_config.name
 
         # Create API parameters (excluding unsupported parameters)
         api_params = {
@@ -104,32 +124,48 @@ def generate_response_with_groq(prompt, chat_id=None):
         logger.error(f"Error in Groq API call: {str(e)}")
         yield "Sorry, I encountered an error."
 
+@st.cache_resource(show_spinner=False)
+def get_sentiment_executor():
+    """Single worker used to run sentiment analysis alongside the LLM request."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="sentiment")
+
+def persist_sentiment(chat_id, sentiment_future):
+    """Queue a finished sentiment analysis for storage.
+
+    Runs as a done-callback on the worker thread, so the record is saved even
+    if the script run is stopped (e.g. the user sends another message mid-stream).
+    """
+    try:
+        database.enqueue_sentiment(chat_id, sentiment_future.result())
+    except Exception as e:
+        logger.error(f"Error saving sentiment: {str(e)}")
+
+def record_sentiment(sentiment_future, placeholder):
+    """Wait for a pending sentiment analysis, then store it in session and display it."""
+    try:
+        sentiment_info = sentiment_future.result()
+        StateManager.update_sentiment_history(sentiment_info)
+
+        # Show resources if sentiment is negative; set before drawing, which
+        # raises if a rerun is pending
+        if sentiment_info["mood"] == "negative" and sentiment_info["confidence"] > 0.5:
+            st.session_state.show_resources = True
+
+        placeholder.markdown(format_sentiment_html(sentiment_info), unsafe_allow_html=True)
+    except Exception as e:
+        logger.error(f"Error analyzing sentiment: {str(e)}")
+
 def process_message(message, role="user"):
     """Process and store chat messages."""
     try:
-        if role == "user":
-            sentiment_info = analyze_sentiment(message)
-            st.session_state.sentiment_history.append(sentiment_info)
-            st.markdown(format_sentiment_html(sentiment_info), unsafe_allow_html=True)
-            
-            # Show resources if sentiment is negative
-            if sentiment_info["mood"] == "negative" and sentiment_info["confidence"] > 0.5:
-                st.session_state.show_resources = True
-
-        chat_id = database.save_message(st.session_state.current_chat_id, role, message)
+        chat_id = database.enqueue_message(st.session_state.current_chat_id, role, message)
         if chat_id != st.session_state.current_chat_id and chat_id is not None:
             st.session_state.current_chat_id = chat_id
             
-        memory = get_or_create_memory(st.session_state.current_chat_id)
-        if role == "user":
-            memory.chat_memory.add_user_message(message)
-        else:
-            memory.chat_memory.add_ai_message(message)
+        remember_message(st.session_state.current_chat_id, role, message)
 
-        # Update chat history in session state
-        if "chat_history" not in st.session_state:
-            st.session_state.chat_history = []
-        st.session_state.chat_history.append({"role": role, "content": message})
+        # Session state is the authoritative render source; the DB is for durability
+        StateManager.update_chat_history({"role": role, "content": message})
 
     except Exception as e:
         logger.error(f"Error processing message: {str(e)}")
@@ -138,36 +174,72 @@ def process_message(message, role="user"):
 # Main Chat UI
 st.title("💭 Mental Health Chat Assistant")
 
+# Without a key only local models are listed, and those can't be served here
+if not st.session_state.GROQ_API_KEY:
+    st.error(MISSING_API_KEY_MESSAGE)
+
 # Display chat history
 if "chat_history" in st.session_state:
     for message in st.session_state.chat_history:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
 
-if prompt := st.chat_input("How are you feeling today?"):
+if prompt := st.chat_input("How are you feeling today?", disabled=not st.session_state.GROQ_API_KEY):
     if not st.session_state.current_chat_id:
         chat_id = database.create_chat("New Conversation")
         if chat_id:
             st.session_state.current_chat_id = chat_id
 
+    # Start sentiment analysis now so it overlaps with the Groq request
+    sentiment_future = get_sentiment_executor().submit(analyze_sentiment, prompt)
+    sentiment_future.add_done_callback(partial(persist_sentiment, st.session_state.current_chat_id))
+
     with st.chat_message("user"):
         st.markdown(prompt)
 
+    # Reserve the badge's spot; it is filled in once the analysis finishes
+    sentiment_placeholder = st.empty()
     process_message(prompt, role="user")
 
-    with st.chat_message("assistant"):
-        message_placeholder = st.empty()
-        full_response = ""
-        
-        for response_chunk in generate_response_with_groq(prompt, st.session_state.current_chat_id):
-            full_response += response_chunk
-            message_placeholder.markdown(full_response + "▌")  # Streaming effect
-        
-        message_placeholder.markdown(full_response)
-        process_message(full_response, role="assistant")
+    unavailable_reason = get_model_unavailable_reason()
+    sentiment_recorded = False
+    try:
+        with st.chat_message("assistant"):
+            if unavailable_reason:
+                # Shown as a notice, not model output: never saved or sent back as context
+                st.warning(unavailable_reason)
+            else:
+                message_placeholder = st.empty()
+                response_chunks = []
+                pending_chars = 0
+                last_update = time.monotonic()
+                
+                for response_chunk in generate_response_with_groq(prompt, st.session_state.current_chat_id):
+                    # Show the badge as soon as the analysis is ready, not after the whole reply
+                    if not sentiment_recorded and sentiment_future.done():
+                        sentiment_recorded = True
+                        record_sentiment(sentiment_future, sentiment_placeholder)
+                    response_chunks.append(response_chunk)
+                    pending_chars += len(response_chunk)
+                    # Coalesce re-renders instead of pushing every token to the browser
+                    now = time.monotonic()
+                    if pending_chars >= STREAM_UPDATE_CHARS or now - last_update >= STREAM_UPDATE_INTERVAL:
+                        message_placeholder.markdown("".join(response_chunks) + "▌")  # Streaming effect
+                        pending_chars = 0
+                        last_update = now
+                
+                full_response = "".join(response_chunks)
+                message_placeholder.markdown(full_response)
+                process_message(full_response, role="assistant")
+    finally:
+        # Fallback for short or interrupted streams: runs even when a new
+        # message stops this script mid-stream
+        if not sentiment_recorded:
+            record_sentiment(sentiment_future, sentiment_placeholder)
 
 # Show Mental Health Resources
 if st.session_state.show_resources:
     with st.expander("Mental Health Resources", expanded=True):
-        for resource in get_resources():
-            st.markdown(f"### {resource['name']}\n{resource['description']}\n[Visit Website]({resource['url']})")
+        history = st.session_state.sentiment_history
+        current_mood = history[-1]["mood"] if history else "negative"
+        st.markdown(render_resources_markdown(current_mood))
@@ -1,12 +1,17 @@
 """Database management for the Streamlit chat application."""
 import peewee as pw
-from datetime import datetime
+from playhouse.pool import PooledSqliteDatabase
+from datetime import datetime, timezone
 import os
 from contextlib import contextmanager
 from typing import List, Dict, Optional
 import logging
 import uuid
 import sys
+import time
+import queue
+import atexit
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,65 +21,99 @@ logger = logging.getLogger(__name__)
 DB_DIR = os.path.dirname(os.path.abspath(__file__))
 DB_FILE = os.path.join(DB_DIR, 'chat_history.db')
 
-# Initialize database with connection pooling
-db = pw.SqliteDatabase(None)
+# Initialize database with connection pooling; connections are reused across
+# calls (and Streamlit script threads) instead of being reopened every time.
+# A full pool makes callers wait up to `timeout` seconds rather than fail outright.
+db = PooledSqliteDatabase(None, max_connections=8, stale_timeout=300, timeout=10)
+
+# Background writer settings for enqueue_message / enqueue_sentiment
+WRITE_BATCH_SIZE = 64
+WRITE_COALESCE_SECONDS = 0.01
+WRITE_MAX_RETRIES = 5
+WRITE_RETRY_BACKOFF_SECONDS = 0.1
+
+_write_queue: "queue.Queue[tuple]" = queue.Queue()
+_writer_thread: Optional[threading.Thread] = None
+_writer_lock = threading.Lock()
+
+def utcnow() -> datetime:
+    """Current UTC time as a naive datetime, the format all timestamps are stored in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
 class DatabaseManager:
     """Manages database operations with connection pooling and error handling."""
     
-    @staticmethod
-    def initialize_database() -> None:
-        """Initialize database connection and create tables."""
-        try:
-            # Ensure database directory exists
-            os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-            
-            # Initialize database with optimized settings
-            db.init(DB_FILE, pragmas={
-                'journal_mode': 'wal',
-                'cache_size': -1024 * 64,
-                'foreign_keys': 1,
-                'synchronous': 0
-            })
-            
-            # Create tables
-            with db:
-                db.create_tables([Messages, Chat, Prompts], safe=True)
-            logger.info(f"Database initialized successfully at {DB_FILE}")
-            
-        except Exception as e:
-            logger.error(f"Database initialization failed: {str(e)}")
-            raise
+    _initialized = False
+    _init_lock = threading.Lock()
+    
+    @classmethod
+    def initialize_database(cls) -> None:
+        """Initialize database connection and create tables once per process."""
+        with cls._init_lock:
+            # Streamlit reruns and multipage imports call this repeatedly
+            if cls._initialized:
+                return
+            try:
+                # Ensure database directory exists
+                os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
+                
+                # Initialize database with optimized settings
+                db.init(DB_FILE, check_same_thread=False, pragmas={
+                    'journal_mode': 'wal',
+                    'cache_size': -1024 * 64,
+                    'foreign_keys': 1,
+                    'synchronous': 0,
+                    'busy_timeout': 5000,  # wait up to 5s on concurrent writers
+                    'mmap_size': 256 * 1024 * 1024,
+                    'temp_store': 2,  # MEMORY
+                    'wal_autocheckpoint': 1000
+                })
+                
+                # Create tables
+                with db:
+                    db.create_tables([Messages, Chat, Prompts, Sentiments], safe=True)
+                cls._initialized = True
+                logger.info(f"Database initialized successfully at {DB_FILE}")
+                
+            except Exception as e:
+                logger.error(f"Database initialization failed: {str(e)}")
+                raise
 
     @staticmethod
     @contextmanager
     def get_db():
-        """Get database connection from pool."""
-        if db.is_closed():
+        """Get database connection from pool.
+
+        Closing a pooled connection returns it to the pool rather than
+        tearing it down, so the file handle and WAL index are reused.
+        """
+        opened = db.is_closed()
+        if opened:
             db.connect()
         try:
             yield db
         finally:
-            if not db.is_closed():
+            # Only release connections this context acquired
+            if opened and not db.is_closed():
                 db.close()
 
 class BaseModel(pw.Model):
     """Base model with timestamp fields."""
-    created_at = pw.DateTimeField(default=datetime.now)
-    updated_at = pw.DateTimeField(default=datetime.now)
+    created_at = pw.DateTimeField(default=utcnow)
+    updated_at = pw.DateTimeField(default=utcnow)
     
     class Meta:
         database = db
     
     def save(self, *args, **kwargs):
-        self.updated_at = datetime.now()
+        self.updated_at = utcnow()
         return super().save(*args, **kwargs)
 
 class Chat(BaseModel):
     """Chat session model."""
     id = pw.CharField(primary_key=True)
     title = pw.CharField()
-    last_message = pw.DateTimeField(default=datetime.now)
+    last_message = pw.DateTimeField(default=utcnow)
     
     class Meta:
         table_name = 'chats'
@@ -88,6 +127,10 @@ class Messages(BaseModel):
     
     class Meta:
         table_name = 'messages'
+        # Covers get_chat_history's filter + ORDER BY so no sort is needed
+        indexes = (
+            (('chat_id', 'id'), False),
+        )
 
 class Prompts(BaseModel):
     """Prompt templates model."""
@@ -100,6 +143,18 @@ class Prompts(BaseModel):
     class Meta:
         table_name = 'prompts'
 
+class Sentiments(BaseModel):
+    """Per-message sentiment model used for long-term mood statistics."""
+    id = pw.AutoField()
+    chat_id = pw.ForeignKeyField(Chat, backref='sentiments', on_delete='CASCADE')
+    mood = pw.CharField()
+    polarity = pw.FloatField()
+    subjectivity = pw.FloatField()
+    confidence = pw.FloatField()
+    
+    class Meta:
+        table_name = 'sentiments'
+
 def get_all_chats() -> List[Dict]:
     """Get all chat sessions ordered by last message."""
     try:
@@ -110,58 +165,171 @@ def get_all_chats() -> List[Dict]:
         logger.error(f"Error fetching chats: {str(e)}")
         return []
 
+# Fixed SQL for the per-message write path; sqlite3 caches the prepared
+# statements by text, so repeat calls skip peewee's query building and parsing
+_UPDATE_CHAT_SQL = "UPDATE chats SET last_message = ?, updated_at = ? WHERE id = ?"
+_INSERT_CHAT_SQL = ("INSERT OR IGNORE INTO chats (id, title, last_message, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?)")
+_INSERT_MESSAGE_SQL = ("INSERT INTO messages (chat_id, role, content, created_at, updated_at) "
+                       "VALUES (?, ?, ?, ?, ?)")
+
+def _write_message(chat_id: str, role: str, content: str, is_new: bool, now: datetime) -> None:
+    """Write a message and touch its chat; the caller owns the transaction."""
+    # Existing chats only need their last message time bumped (bare UPDATE,
+    # no SELECT roundtrip); a miss falls through to the single create path
+    if not is_new and not db.execute_sql(_UPDATE_CHAT_SQL, (now, now, chat_id)).rowcount:
+        logger.warning(f"Chat {chat_id} not found, creating it")
+        is_new = True
+
+    if is_new:
+        # OR IGNORE: a concurrent writer creating the same chat isn't an error
+        title = content[:50] + "..." if len(content) > 50 else content
+        db.execute_sql(_INSERT_CHAT_SQL, (chat_id, title, now, now, now))
+
+    # Save message in the same transaction as the chat update
+    db.execute_sql(_INSERT_MESSAGE_SQL, (chat_id, role, content, now, now))
+
 def save_message(chat_id: Optional[str], role: str, content: str) -> str:
     """Save a message to the database."""
+    # Create new chat if needed; the id is returned even if the write fails
+    # to maintain conversation flow
+    is_new = not chat_id
+    chat_id = chat_id or str(uuid.uuid4())
     try:
-        with DatabaseManager.get_db():
-            # Create new chat if needed
-            if not chat_id:
-                chat_id = str(uuid.uuid4())
-                Chat.create(
-                    id=chat_id,
-                    title=content[:50] + "..." if len(content) > 50 else content
-                )
-            
-            # Update chat's last message time
-            try:
-                chat = Chat.get(Chat.id == chat_id)
-                chat.last_message = datetime.now()
-                chat.save()
-            except pw.DoesNotExist:
-                # Create the chat if it doesn't exist
-                logger.warning(f"Chat {chat_id} not found, creating new chat")
-                chat_id = str(uuid.uuid4())
-                Chat.create(
-                    id=chat_id,
-                    title=content[:50] + "..." if len(content) > 50 else content
-                )
-            
-            # Save message
-            Messages.create(
-                chat_id=chat_id,
-                role=role,
-                content=content
-            )
-            
-            return chat_id
+        with DatabaseManager.get_db(), db.atomic():
+            _write_message(chat_id, role, content, is_new, utcnow())
     except Exception as e:
         logger.error(f"Error saving message: {str(e)}")
-        # Return chat_id even if there's an error to maintain conversation flow
-        return chat_id if chat_id else str(uuid.uuid4())
+    return chat_id
+
+def _write_sentiment(chat_id: str, sentiment_info: Dict) -> None:
+    """Write a sentiment record; the caller owns the transaction."""
+    Sentiments.create(
+        chat_id=chat_id,
+        mood=sentiment_info["mood"],
+        polarity=sentiment_info["polarity"],
+        subjectivity=sentiment_info["subjectivity"],
+        confidence=sentiment_info["confidence"]
+    )
+
+def _commit_batch(batch: List[tuple]) -> None:
+    """Run a batch of queued writes in one transaction."""
+    with DatabaseManager.get_db(), db.atomic():
+        for write, args in batch:
+            try:
+                # Savepoint per write so one bad row doesn't drop the batch
+                with db.atomic():
+                    write(*args)
+            except pw.OperationalError:
+                # Busy/locked database: the transaction is deferred, so the
+                # lock error surfaces here on the first write. Abort the
+                # batch so the writer loop retries all of it.
+                raise
+            except Exception as e:
+                logger.error(f"Error in queued write for chat {args[0]}: {str(e)}")
+
+def _writer_loop() -> None:
+    """Drain queued writes, committing each batch in one transaction."""
+    while True:
+        batch = [_write_queue.get()]
+        # Short coalescing window so back-to-back writes share a commit
+        time.sleep(WRITE_COALESCE_SECONDS)
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                batch.append(_write_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        try:
+            # Connect, lock and commit failures roll the whole batch back, so
+            # retry it with backoff rather than dropping it
+            for attempt in range(WRITE_MAX_RETRIES + 1):
+                try:
+                    _commit_batch(batch)
+                    break
+                except Exception as e:
+                    if attempt == WRITE_MAX_RETRIES:
+                        logger.error(f"Dropping {len(batch)} queued writes after {attempt + 1} attempts: {str(e)}")
+                    else:
+                        delay = WRITE_RETRY_BACKOFF_SECONDS * 2 ** attempt
+                        logger.warning(f"Error committing queued writes, retrying in {delay:.1f}s: {str(e)}")
+                        time.sleep(delay)
+        finally:
+            for _ in batch:
+                _write_queue.task_done()
+
+def _ensure_writer() -> None:
+    """Start the background writer thread once per process."""
+    global _writer_thread
+    with _writer_lock:
+        if _writer_thread is None or not _writer_thread.is_alive():
+            _writer_thread = threading.Thread(target=_writer_loop, name="db-writer", daemon=True)
+            _writer_thread.start()
+
+def enqueue_message(chat_id: Optional[str], role: str, content: str) -> str:
+    """Queue a message for the background writer and return its chat id immediately."""
+    is_new = not chat_id
+    chat_id = chat_id or str(uuid.uuid4())
+    _ensure_writer()
+    # Timestamp at enqueue time so batching delay doesn't skew message times
+    _write_queue.put((_write_message, (chat_id, role, content, is_new, utcnow())))
+    return chat_id
+
+def enqueue_sentiment(chat_id: str, sentiment_info: Dict) -> None:
+    """Queue a sentiment record for the background writer."""
+    _ensure_writer()
+    _write_queue.put((_write_sentiment, (chat_id, sentiment_info)))
+
+def flush_writes() -> None:
+    """Block until all queued writes have been committed."""
+    _write_queue.join()
 
 def get_chat_history(chat_id: str) -> List[Dict]:
     """Get chat history with proper connection handling."""
     try:
         with DatabaseManager.get_db():
+            # Select only the needed columns as dicts to skip model instantiation
             messages = (Messages
-                       .select()
+                       .select(Messages.role, Messages.content)
                        .where(Messages.chat_id == chat_id)
-                       .order_by(Messages.id))
-            return [{"role": msg.role, "content": msg.content} for msg in messages]
+                       .order_by(Messages.id)
+                       .dicts())
+            return list(messages)
     except Exception as e:
         logger.error(f"Error fetching chat history: {str(e)}")
         return []
 
+def get_sentiment_stats(chat_id: str) -> Optional[Dict]:
+    """Aggregate a chat's full sentiment history in SQL."""
+    try:
+        with DatabaseManager.get_db():
+            rows = (Sentiments
+                    .select(Sentiments.mood,
+                            pw.fn.COUNT(Sentiments.id),
+                            pw.fn.SUM(Sentiments.polarity),
+                            pw.fn.SUM(Sentiments.subjectivity))
+                    .where(Sentiments.chat_id == chat_id)
+                    .group_by(Sentiments.mood)
+                    .tuples())
+            mood_counts = {}
+            polarity_sum = subjectivity_sum = 0.0
+            for mood, count, polarity, subjectivity in rows:
+                mood_counts[mood] = count
+                polarity_sum += polarity
+                subjectivity_sum += subjectivity
+            total = sum(mood_counts.values())
+            if not total:
+                return None
+            return {
+                "count": total,
+                "avg_polarity": polarity_sum / total,
+                "avg_subjectivity": subjectivity_sum / total,
+                "mood_counts": mood_counts
+            }
+    except Exception as e:
+        logger.error(f"Error fetching sentiment stats for chat {chat_id}: {str(e)}")
+        return None
+
 def delete_chat(chat_id: str) -> bool:
     """Delete a chat and all its messages."""
     try:
@@ -180,39 +348,71 @@ def delete_chat(chat_id: str) -> bool:
         return False
 
 def save_prompt(name: str, content: str, description: Optional[str] = None, is_default: bool = False) -> bool:
-    """Save a prompt template."""
+    """Save a prompt template, updating it in place if the name already exists."""
     try:
         with DatabaseManager.get_db():
-            Prompts.create(
-                name=name,
-                content=content,
-                description=description,
-                is_default=is_default
-            )
+            (Prompts
+             .insert(
+                 name=name,
+                 content=content,
+                 description=description,
+                 is_default=is_default
+             )
+             .on_conflict(
+                 conflict_target=[Prompts.name],
+                 update={
+                     Prompts.content: content,
+                     Prompts.description: description,
+                     Prompts.is_default: is_default,
+                     Prompts.updated_at: utcnow()
+                 }
+             )
+             .execute())
             logger.info(f"Successfully saved prompt: {name}")
             return True
     except Exception as e:
         logger.error(f"Failed to save prompt {name}: {str(e)}")
         return False
 
+# Fixed SQL for prompt lookups, which run on most reruns; sqlite3 reuses the
+# prepared statement on the pooled connection
+_GET_PROMPT_SQL = "SELECT id, name, content, description, is_default FROM prompts WHERE name = ?"
+
 def get_prompt(name: str) -> Optional[Dict]:
     """Get a prompt template by name."""
     try:
         with DatabaseManager.get_db():
-            prompt = Prompts.get_or_none(Prompts.name == name)
-            if prompt:
+            row = db.execute_sql(_GET_PROMPT_SQL, (name,)).fetchone()
+            if row:
+                prompt_id, prompt_name, content, description, is_default = row
                 return {
-                    "id": prompt.id,
-                    "name": prompt.name,
-                    "content": prompt.content,
-                    "description": prompt.description,
-                    "is_default": prompt.is_default
+                    "id": prompt_id,
+                    "name": prompt_name,
+                    "content": content,
+                    "description": description,
+                    "is_default": bool(is_default)
                 }
             return None
     except Exception as e:
         logger.error(f"Failed to get prompt {name}: {str(e)}")
         return None
 
+def get_prompts_by_names(names: List[str]) -> Dict[str, Dict]:
+    """Get several prompt templates in one query, keyed by name."""
+    try:
+        with DatabaseManager.get_db():
+            prompts = Prompts.select().where(Prompts.name.in_(names))
+            return {p.name: {
+                "id": p.id,
+                "name": p.name,
+                "content": p.content,
+                "description": p.description,
+                "is_default": p.is_default
+            } for p in prompts}
+    except Exception as e:
+        logger.error(f"Failed to get prompts {names}: {str(e)}")
+        return {}
+
 def get_all_prompts() -> List[Dict]:
     """Get all prompt templates."""
     try:
@@ -259,3 +459,6 @@ def create_chat(title: str) -> str:
 
 # Initialize database on module import
 DatabaseManager.initialize_database()
+
+# Make sure queued writes reach disk before the process exits
+atexit.register(flush_writes)
@@ -1,10 +1,10 @@
 """Mental health analysis and support module."""
-from textblob import TextBlob
 import emoji
 from typing import Dict, Any, List
 import logging
 from functools import lru_cache
 import re
+import string
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,7 +12,15 @@ logger = logging.getLogger(__name__)
 
 # Precompile regex patterns for faster text processing
 EMOJI_PATTERN = re.compile(r':[a-zA-Z0-9_]+:')
-PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+# Translation table strips ASCII punctuation in a single C-level pass
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+@lru_cache(maxsize=1)
+def get_sentiment_analyzer():
+    """Build the lexicon-based scorer on first use and share it across calls."""
+    # Imported lazily so pages that never score text skip loading the lexicon
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
 
 # Simplified resources for faster lookup
 MENTAL_HEALTH_RESOURCES = {
@@ -64,20 +72,16 @@ def clean_text(text: str) -> str:
     """Clean text for faster processing."""
     # Remove emojis using regex (faster than emoji library)
     text = EMOJI_PATTERN.sub('', text)
-    # Remove punctuation
-    text = PUNCTUATION_PATTERN.sub('', text)
-    # Convert to lowercase
-    return text.lower().strip()
+    # Remove punctuation and convert to lowercase
+    return text.translate(PUNCTUATION_TABLE).lower().strip()
 
 @lru_cache(maxsize=1000)
 def analyze_sentiment(text: str) -> Dict[str, Any]:
-    """Analyze text sentiment using TextBlob with optimized caching."""
+    """Analyze text sentiment using VADER with optimized caching."""
     try:
-        # Clean text for faster processing
-        text_clean = clean_text(text)
-        
-        # Quick sentiment check for empty or very short text
-        if not text_clean or len(text_clean) < 3:
+        # Quick sentiment check for empty text; no length floor, since a bare
+        # emoticon like ":(" is only two characters but still carries sentiment
+        if not text.strip():
             return {
                 "mood": "neutral",
                 "confidence": 0.5,
@@ -85,15 +89,17 @@ def analyze_sentiment(text: str) -> Dict[str, Any]:
                 "polarity": 0.0
             }
         
-        # Analyze sentiment
-        analysis = TextBlob(text_clean)
-        polarity = analysis.sentiment.polarity
+        # Analyze the raw text: VADER reads capitals, "!" and emoticons as intensity cues
+        scores = get_sentiment_analyzer().polarity_scores(text)
+        polarity = scores["compound"]
+        # Share of non-neutral wording stands in for subjectivity
+        subjectivity = 1.0 - scores["neu"]
         
-        # Adjusted thresholds based on TextBlob's typical output range
-        # TextBlob polarity ranges from -1 to 1, with 0.5/-0.5 being moderately positive/negative
-        if polarity <= -0.3:
+        # VADER's compound score ranges from -1 to 1; its authors use +/-0.05 as the
+        # neutral band (TextBlob's +/-0.3 hid mildly negative messages)
+        if polarity <= -0.05:
             mood = "negative"
-        elif polarity >= 0.3:
+        elif polarity >= 0.05:
             mood = "positive"
         else:
             mood = "neutral"
@@ -101,7 +107,7 @@ def analyze_sentiment(text: str) -> Dict[str, Any]:
         return {
             "mood": mood,
             "confidence": min(abs(polarity * 2), 1.0),  # Scale confidence to be between 0 and 1
-            "subjectivity": analysis.sentiment.subjectivity,
+            "subjectivity": subjectivity,
             "polarity": polarity
         }
     except Exception as e:
@@ -126,8 +132,13 @@ def get_sentiment_color(mood: str) -> str:
 
 def format_sentiment_html(sentiment_info: Dict[str, Any]) -> str:
     """Create HTML for sentiment visualization."""
-    color = get_sentiment_color(sentiment_info["mood"])
-    confidence = int(sentiment_info["confidence"] * 100)
+    return _sentiment_badge_html(sentiment_info["mood"], int(sentiment_info["confidence"] * 100))
+
+# 3 moods x 101 confidence percentages covers every possible badge
+@lru_cache(maxsize=512)
+def _sentiment_badge_html(mood: str, confidence: int) -> str:
+    """Build the sentiment badge HTML for a mood/confidence pair with caching."""
+    color = get_sentiment_color(mood)
     
     return f"""
     <div style="
@@ -138,7 +149,7 @@ def format_sentiment_html(sentiment_info: Dict[str, Any]) -> str:
         display: inline-block;
         font-size: 14px;
         margin: 5px 0;">
-        Mood: {sentiment_info["mood"].title()} ({confidence}%)
+        Mood: {mood.title()} ({confidence}%)
     </div>
     """
 
@@ -147,6 +158,17 @@ def get_resources(mood: str) -> List[Dict[str, str]]:
     """Get relevant mental health resources with caching."""
     return MENTAL_HEALTH_RESOURCES.get(mood, MENTAL_HEALTH_RESOURCES["neutral"])
 
+@lru_cache(maxsize=10)
+def render_resources_markdown(mood: str) -> str:
+    """Render the resource list for a mood as one cached markdown block."""
+    sections = []
+    for resource in get_resources(mood):
+        section = f"### {resource['title']}\n{resource['description']}"
+        if "contact" in resource:
+            section += f"\n\nContact: {resource['contact']}"
+        sections.append(f"{section}\n\n[Visit Website]({resource['url']})")
+    return "\n\n".join(sections)
+
 def generate_mental_health_prompt(user_input: str, sentiment_info: Dict[str, Any]) -> str:
     """Generate a mental health-focused prompt based on user input and sentiment."""
     mood = sentiment_info["mood"]
@@ -1,10 +1,15 @@
 import streamlit as st
 import sys
 import os
+from collections import Counter
 
-# Add parent directory to path to import mental_health module
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Add parent directory to path to import mental_health module; guarded because
+# Streamlit re-executes this script on every rerun
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
 from mental_health import analyze_sentiment, get_resources, format_sentiment_html
+import database
 
 st.set_page_config(
     page_title="Mental Health Analytics",
@@ -45,17 +50,28 @@ with col1:
         
         # Mood Statistics
         st.markdown("#### 📉 Mood Statistics")
-        if len(st.session_state.sentiment_history) > 1:
-            # Calculate averages
-            avg_polarity = sum(s['polarity'] for s in st.session_state.sentiment_history) / len(st.session_state.sentiment_history)
-            avg_subjectivity = sum(s['subjectivity'] for s in st.session_state.sentiment_history) / len(st.session_state.sentiment_history)
-            
-            # Count emotions
-            mood_counts = {}
-            for s in st.session_state.sentiment_history:
-                mood = s['mood']
-                mood_counts[mood] = mood_counts.get(mood, 0) + 1
-            
+        # Session only keeps a recent window, so prefer the chat's full stats from SQLite
+        chat_id = st.session_state.get("current_chat_id")
+        stats = database.get_sentiment_stats(chat_id) if chat_id else None
+        if stats:
+            total = stats["count"]
+            avg_polarity = stats["avg_polarity"]
+            avg_subjectivity = stats["avg_subjectivity"]
+            mood_counts = Counter(stats["mood_counts"])
+        else:
+            # Calculate averages and count emotions in a single pass
+            history = st.session_state.sentiment_history
+            total = len(history)
+            polarity_sum = subjectivity_sum = 0.0
+            mood_counts = Counter()
+            for s in history:
+                polarity_sum += s['polarity']
+                subjectivity_sum += s['subjectivity']
+                mood_counts[s['mood']] += 1
+            avg_polarity = polarity_sum / total
+            avg_subjectivity = subjectivity_sum / total
+
+        if total > 1:
             # Display statistics
             st.markdown(f"""
             **Overall Mood Analysis:**
@@ -66,8 +82,8 @@ with col1:
             """)
             
             # Show top 3 moods
-            for mood, count in sorted(mood_counts.items(), key=lambda x: x[1], reverse=True)[:3]:
-                percentage = (count / len(st.session_state.sentiment_history)) * 100
+            for mood, count in mood_counts.most_common(3):
+                percentage = (count / total) * 100
                 st.markdown(f"- {mood.title()}: {int(percentage)}%")
     else:
         st.info("Start chatting to see your mood analysis!")
@@ -1,44 +1,17 @@
 import streamlit as st
 import sys
 import os
-import database
 
-# Add parent directory to path to import from app.py
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+# Add parent directory to path to import project modules; guarded because
+# Streamlit re-executes this script on every rerun
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
 
+import database
 # Import from state_manager to get the same models
 from state_manager import StateManager
 
-# Initialize session state variables if they don't exist
-if "MODELS" not in st.session_state:
-    # Use the models from state_manager to ensure consistency
-    st.session_state.MODELS = StateManager.get_models()
-
-if "selected_model" not in st.session_state:
-    st.session_state.selected_model = "Groq-LLaMA3-8B"  # Default to Groq model
-
-if "PERSONALITIES" not in st.session_state:
-    st.session_state.PERSONALITIES = StateManager.get_personalities()
-
-if "personality" not in st.session_state:
-    st.session_state.personality = "friendly"
-
-if "model_params" not in st.session_state:
-    st.session_state.model_params = {
-        "temperature": 0.7,
-        "top_p": 0.9,
-        "max_length": 256,
-        "min_length": 1,
-        "repetition_penalty": 1.2,
-        "presence_penalty": 0.0
-    }
-
-if "PROMPTS" not in st.session_state:
-    st.session_state.PROMPTS = {}
-
-if "current_prompt" not in st.session_state:
-    st.session_state.current_prompt = ""
-
 # Page config
 st.set_page_config(
     page_title="Settings - Mental Health AI Assistant",
@@ -46,37 +19,75 @@ st.set_page_config(
     layout="wide"
 )
 
-# Title
-st.title("⚙️ Settings")
-
-# Create tabs for different settings
-tab1, tab2, tab3, tab4 = st.tabs(["Model Settings", "Prompt Templates", "Personality Settings", "Personality Prompts"])
+# Initialize session state (no-op after the first run in this session)
+StateManager.initialize_state()
 
-with tab1:
-    # Model Selection
-    st.header("Model Selection")
+MODELS = StateManager.get_models()
+PERSONALITIES = StateManager.get_personalities()
 
-    # Model Size Guide
-    st.markdown("""
+# Static markdown for the model section
+MODEL_SIZE_GUIDE_MD = """
 ### 💡 Model Size Guide:
 - **Small (Fast)**: TinyLlama-Chat, Phi-2
 - **Medium (Balanced)**: Groq-LLaMA3-8B, Groq-Gemma-7B
 - **Large (Powerful)**: Groq-Mixtral-8x7B, Groq-Claude-3-Opus
-""")
+"""
+
+MODEL_DETAILS_TEMPLATE = """
+- **Name**: {model.name}
+- **Description**: {model.description}
+- **Context Length**: {model.context_length} tokens
+- **Size Category**: {model.size_title}
+- **Type**: {model_type}
+"""
+
+# Option lists longer than this get a filter box so the dropdown only holds matches
+OPTION_FILTER_THRESHOLD = 20
+
+def filter_options(key, options, index, labels, selected):
+    """Narrow long option lists with a text filter; returns (options, selected index)."""
+    if len(options) <= OPTION_FILTER_THRESHOLD:
+        return options, index.get(selected, 0)
+    
+    query = st.text_input("Filter options", key=key, placeholder="Type to filter...").strip().lower()
+    if not query:
+        return options, index.get(selected, 0)
+    
+    matches = tuple(option for option in options if query in labels[option].lower())
+    # Keep the current selection available so the selectbox doesn't jump
+    if selected in index and selected not in matches:
+        matches = (selected,) + matches
+    if not matches:
+        return options, 0
+    return matches, matches.index(selected) if selected in matches else 0
+
+# Each section is a fragment so interacting with it reruns only that section
+@st.fragment
+def render_model_tab():
+    """Render model selection, details and parameters."""
+    # Model Selection
+    st.header("Model Selection")
+
+    # Model Size Guide
+    st.markdown(MODEL_SIZE_GUIDE_MD)
 
     # Choose AI Model
     st.subheader("Choose AI Model")
-    model_options = list(st.session_state.MODELS.keys())
+    model_options, model_index = StateManager.get_model_options()
     
     # Handle case where selected model is not in the list
-    if st.session_state.selected_model not in model_options:
+    if st.session_state.selected_model not in model_index:
         st.session_state.selected_model = model_options[0]
         
+    model_labels = StateManager.get_model_labels()
+    model_choices, model_choice_index = filter_options(
+        "model_filter", model_options, model_index, model_labels, st.session_state.selected_model
+    )
     selected_model = st.selectbox(
         "Select a model",
-        model_options,
-        index=model_options.index(st.session_state.selected_model),
-        format_func=lambda x: f"{x} - {st.session_state.MODELS[x]['description']}"
+        model_choices,
+        index=model_choice_index,
+        format_func=model_labels.__getitem__
     )
 
     # Update selected model
@@ -87,22 +98,16 @@ with tab1:
 
     # Model Details
     st.subheader("Model Details")
-    selected_model_info = st.session_state.MODELS[selected_model]
+    selected_model_info = MODELS[selected_model]
     
-    # Check if 'api' key exists to distinguish between local and API models
-    model_type = "API" if selected_model_info.get('api') else "Local"
+    # Local models have api=False; API models name their provider
+    model_type = "API" if selected_model_info.api else "Local"
     
-    st.markdown(f"""
-- **Name**: {selected_model_info['name']}
-- **Description**: {selected_model_info['description']}
-- **Context Length**: {selected_model_info['context_length']} tokens
-- **Size Category**: {selected_model_info['size'].title()}
-- **Type**: {model_type}
-""")
+    st.markdown(MODEL_DETAILS_TEMPLATE.format(model=selected_model_info, model_type=model_type))
 
     # Model Parameters
     st.header("Model Parameters")
-    with st.form("model_params"):
+    with st.form("model_params_form"):
         col1, col2 = st.columns(2)
         
         with col1:
@@ -145,37 +150,49 @@ with tab1:
         
         submit_button = st.form_submit_button("Apply Parameters")
         if submit_button:
-            st.session_state.model_params["temperature"] = temperature
-            st.session_state.model_params["top_p"] = top_p
-            st.session_state.model_params["max_length"] = max_length
-            st.session_state.model_params["repetition_penalty"] = repetition_penalty
+            # Apply all parameters in a single session state write
+            st.session_state.model_params = {
+                **st.session_state.model_params,
+                "temperature": temperature,
+                "top_p": top_p,
+                "max_length": max_length,
+                "repetition_penalty": repetition_penalty
+            }
             st.success("Model parameters updated successfully!")
 
-with tab2:
+@st.fragment
+def render_prompt_templates_tab():
+    """Render the prompt templates placeholder."""
     st.header("Prompt Templates")
     st.info("This feature will be available in a future update.")
 
-with tab3:
+@st.fragment
+def render_personality_tab():
+    """Render personality selection and details."""
     st.header("Personality Settings")
     
     # Choose Personality
     st.subheader("Choose Personality")
-    personality_options = list(st.session_state.PERSONALITIES.keys())
+    personality_options, personality_index = StateManager.get_personality_options()
+    personality_labels = StateManager.get_personality_labels()
+    personality_choices, personality_choice_index = filter_options(
+        "personality_filter", personality_options, personality_index, personality_labels, st.session_state.personality
+    )
     selected_personality = st.selectbox(
         "Select a personality",
-        personality_options,
-        index=personality_options.index(st.session_state.personality) if st.session_state.personality in personality_options else 0,
-        format_func=lambda x: f"{st.session_state.PERSONALITIES[x]['name']} - {st.session_state.PERSONALITIES[x]['description']}"
+        personality_choices,
+        index=personality_choice_index,
+        format_func=personality_labels.__getitem__
     )
     
     # Update selected personality
     if selected_personality != st.session_state.personality:
         st.session_state.personality = selected_personality
-        st.success(f"Personality changed to {st.session_state.PERSONALITIES[selected_personality]['name']}!")
+        st.success(f"Personality changed to {PERSONALITIES[selected_personality]['name']}!")
     
     # Personality Details
     st.subheader("Personality Details")
-    selected_personality_info = st.session_state.PERSONALITIES[selected_personality]
+    selected_personality_info = PERSONALITIES[selected_personality]
     st.markdown(f"""
 - **Name**: {selected_personality_info['name']}
 - **Description**: {selected_personality_info['description']}
@@ -190,25 +207,37 @@ with tab3:
         disabled=True
     )
 
-with tab4:
+@st.fragment
+def render_personality_prompts_tab():
+    """Render the personality prompt editor."""
     st.header("Personality Prompts")
     st.write("Edit the prompts for each personality type")
 
     personalities = StateManager.get_personalities()
+    personality_options, personality_index = StateManager.get_personality_options()
+    personality_names = StateManager.get_personality_names()
+    personality_choices, personality_choice_index = filter_options(
+        "personality_edit_filter", personality_options, personality_index, personality_names, st.session_state.personality
+    )
     selected_personality_to_edit = st.selectbox(
         "Select Personality to Edit",
-        list(personalities.keys()),
-        format_func=lambda x: personalities[x]["name"]
+        personality_choices,
+        index=personality_choice_index,
+        format_func=personality_names.__getitem__
     )
 
-    # Get current prompt from database
+    # Get current prompt from the session cache, reading the database only on first view
+    prompt_cache = st.session_state.setdefault("prompt_cache", {})
     prompt_name = f"personality_{selected_personality_to_edit}"
-    db_prompt = database.get_prompt(prompt_name)
+    current_prompt = prompt_cache.get(prompt_name)
 
-    if db_prompt:
-        current_prompt = db_prompt["content"]
-    else:
-        current_prompt = personalities[selected_personality_to_edit]["prompt"]
+    if current_prompt is None:
+        db_prompt = database.get_prompt(prompt_name)
+        if db_prompt:
+            current_prompt = db_prompt["content"]
+        else:
+            current_prompt = personalities[selected_personality_to_edit]["prompt"]
+        prompt_cache[prompt_name] = current_prompt
 
     edited_prompt = st.text_area(
         "Edit Prompt",
@@ -218,16 +247,41 @@ with tab4:
 
     if st.button("Save Personality Prompt"):
         try:
-            database.save_prompt(
+            if database.save_prompt(
                 prompt_name,
                 edited_prompt,
                 f"{personalities[selected_personality_to_edit]['name']} personality prompt",
                 selected_personality_to_edit == "friendly"  # Set friendly as default
-            )
-            st.success(f"Saved {personalities[selected_personality_to_edit]['name']} prompt!")
+            ):
+                prompt_cache[prompt_name] = edited_prompt
+                StateManager.invalidate_personality_cache()
+                st.success(f"Saved {personalities[selected_personality_to_edit]['name']} prompt!")
+            else:
+                st.error("Error saving prompt.")
         except Exception as e:
             st.error(f"Error saving prompt: {str(e)}")
 
+# Title
+st.title("⚙️ Settings")
+
+# Section switcher for different settings; unlike st.tabs, which builds every
+# tab body on each rerun, only the selected section is rendered
+SECTIONS = {
+    "Model Settings": render_model_tab,
+    "Prompt Templates": render_prompt_templates_tab,
+    "Personality Settings": render_personality_tab,
+    "Personality Prompts": render_personality_prompts_tab
+}
+
+active_section = st.radio(
+    "Settings section",
+    tuple(SECTIONS),
+    horizontal=True,
+    key="settings_section",
+    label_visibility="collapsed"
+)
+SECTIONS[active_section]()
+
 # Warning about model loading
 st.warning("""
 ⚠️ Note: Changing models will require reloading when you return to chat. 
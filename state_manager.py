@@ -1,16 +1,142 @@
 """State management for the Streamlit chat application."""
 import streamlit as st
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple, Mapping, Union
 import database
 import os
+from dataclasses import dataclass
+from functools import lru_cache
+from types import MappingProxyType
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
+@dataclass(frozen=True)
+class Settings:
+    """Process-wide configuration read from the environment."""
+    groq_api_key: Optional[str]
 
-# Set the Groq API key from environment variable with fallback
-GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "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")
-os.environ["GROQ_API_KEY"] = GROQ_API_KEY
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load environment variables from .env file once and return the settings."""
+    load_dotenv()
+    return Settings(groq_api_key=os.environ.get("GROQ_API_KEY") or None)
+
+# Most recent sentiment entries kept in session; the full history lives in SQLite
+SENTIMENT_HISTORY_LIMIT = 200
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Static description of a selectable model."""
+    __slots__ = ("key", "name", "description", "context_length", "size", "api", "size_title")
+    key: str
+    name: str
+    description: str
+    context_length: int
+    size: str
+    api: Union[str, bool]  # API provider name, or False for local models
+    
+    def __post_init__(self):
+        # Display form of the size category (a plain slot, not a field), computed once at import
+        object.__setattr__(self, "size_title", self.size.title())
+
+# Models that run locally
+_LOCAL_MODELS = (
+    ModelSpec(
+        key="TinyLlama-Chat",
+        name="PY007/TinyLlama-1.1B-Chat-v0.3",
+        description="Fast and efficient chat model",
+        context_length=512,
+        size="small",
+        api=False
+    ),
+    ModelSpec(
+        key="Phi-2",
+        name="susnato/phi-2",
+        description="Good performance and speed",
+        context_length=512,
+        size="small",
+        api=False
+    ),
+)
+
+# Models served through the Groq API
+_GROQ_MODELS = (
+    ModelSpec(
+        key="Groq-LLaMA3-8B",
+        name="llama3-8b-8192",
+        description="Fast LLaMA3 8B model",
+        context_length=8192,
+        size="medium",
+        api="groq"
+    ),
+    ModelSpec(
+        key="Groq-Mixtral-8x7B",
+        name="mixtral-8x7b-32768",
+        description="Powerful Mixtral 8x7B model",
+        context_length=32768,
+        size="large",
+        api="groq"
+    ),
+    ModelSpec(
+        key="Groq-Claude-3-Opus",
+        name="claude-3-opus-20240229",
+        description="High-quality Claude 3 Opus model",
+        context_length=8192,
+        size="xlarge",
+        api="groq"
+    ),
+    ModelSpec(
+        key="Groq-Gemma-7B",
+        name="gemma-7b-it",
+        description="Google's Gemma 7B model",
+        context_length=8192,
+        size="medium",
+        api="groq"
+    ),
+)
+
+# Available models, built once at import; Groq models only with an API key.
+# Read-only so the shared mapping can't be mutated from a session.
+_MODELS = MappingProxyType({
+    model.key: model
+    for model in _LOCAL_MODELS + (_GROQ_MODELS if get_settings().groq_api_key else ())
+})
+
+# Shared instruction appended to every personality prompt
+_PERSONALITY_MEMORY_SUFFIX = (
+    "IMPORTANT: You have memory of the entire conversation history provided to you. "
+    "You should acknowledge and remember details shared by the user throughout the conversation. "
+    "Never claim that you don't remember previous parts of the conversation or that each interaction is new. "
+    "Maintain context and continuity throughout the conversation."
+)
+
+# Available personality configurations (read-only, shared by every session)
+_PERSONALITIES = MappingProxyType({
+    "friendly": MappingProxyType({
+        "name": "Friendly",
+        "description": "Warm and conversational",
+        "prompt": f"You are a friendly and helpful mental health AI assistant. Express yourself in a warm and approachable way while maintaining accuracy. {_PERSONALITY_MEMORY_SUFFIX}"
+    }),
+    "professional": MappingProxyType({
+        "name": "Professional",
+        "description": "Direct and clear",
+        "prompt": f"You are a professional mental health AI assistant. Be direct and clear in your responses. {_PERSONALITY_MEMORY_SUFFIX}"
+    }),
+    "therapeutic": MappingProxyType({
+        "name": "Therapeutic",
+        "description": "Supportive and empathetic",
+        "prompt": f"You are a therapeutic mental health AI assistant focused on providing emotional support. Respond with empathy and understanding while offering constructive guidance. {_PERSONALITY_MEMORY_SUFFIX}"
+    })
+})
+
+# Selectbox options and their positions, so widgets don't rebuild them per rerun
+_MODEL_KEYS = tuple(_MODELS)
+_MODEL_INDEX = MappingProxyType({key: i for i, key in enumerate(_MODEL_KEYS)})
+_PERSONALITY_KEYS = tuple(_PERSONALITIES)
+_PERSONALITY_INDEX = MappingProxyType({key: i for i, key in enumerate(_PERSONALITY_KEYS)})
+
+# Selectbox display labels, formatted once instead of per option per rerun
+_MODEL_LABELS = MappingProxyType({key: f"{key} - {model.description}" for key, model in _MODELS.items()})
+_PERSONALITY_LABELS = MappingProxyType({key: f"{p['name']} - {p['description']}" for key, p in _PERSONALITIES.items()})
+_PERSONALITY_NAMES = MappingProxyType({key: p["name"] for key, p in _PERSONALITIES.items()})
 
 class StateManager:
     """Manages application state in a centralized way."""
@@ -23,6 +149,10 @@ class StateManager:
             database.DatabaseManager.initialize_database()
         except Exception as e:
             st.error(f"Database initialization error: {str(e)}")
+        
+        # Everything below only needs to run once per session, not on every rerun
+        if st.session_state.get("_state_initialized"):
+            return
             
         defaults = {
             "chat_history": [],
@@ -41,7 +171,7 @@ class StateManager:
                 "repetition_penalty": 1.2
             },
             "api_keys": {
-                "groq": GROQ_API_KEY  # Set the API key directly
+                "groq": get_settings().groq_api_key
             },
             "use_api": True  # Flag to determine if using API or local model
         }
@@ -56,6 +186,8 @@ class StateManager:
         
         # Initialize personality prompts in database
         StateManager.initialize_personality_prompts()
+        
+        st.session_state._state_initialized = True
     
     @staticmethod
     def initialize_default_prompt() -> None:
@@ -72,29 +204,14 @@ class StateManager:
     @staticmethod
     def initialize_personality_prompts() -> None:
         """Initialize personality prompts in the database."""
-        personalities = {
-            "friendly": {
-                "name": "Friendly",
-                "description": "Warm and conversational",
-                "prompt": "You are a friendly and helpful mental health AI assistant. Express yourself in a warm and approachable way while maintaining accuracy. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            },
-            "professional": {
-                "name": "Professional",
-                "description": "Direct and clear",
-                "prompt": "You are a professional mental health AI assistant. Be direct and clear in your responses. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            },
-            "therapeutic": {
-                "name": "Therapeutic",
-                "description": "Supportive and empathetic",
-                "prompt": "You are a therapeutic mental health AI assistant focused on providing emotional support. Respond with empathy and understanding while offering constructive guidance. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            }
-        }
+        # Look up all personality prompts in one query
+        prompt_names = {key: f"personality_{key}" for key in _PERSONALITIES}
+        existing_prompts = database.get_prompts_by_names(list(prompt_names.values()))
         
-        # Save each personality prompt to database
-        for key, personality in personalities.items():
-            prompt_name = f"personality_{key}"
-            existing_prompt = database.get_prompt(prompt_name)
-            if not existing_prompt:
+        # Save each missing personality prompt to database
+        for key, personality in _PERSONALITIES.items():
+            prompt_name = prompt_names[key]
+            if prompt_name not in existing_prompts:
                 database.save_prompt(
                     prompt_name,
                     personality["prompt"],
@@ -103,83 +220,42 @@ class StateManager:
                 )
     
     @staticmethod
-    def get_models() -> Dict[str, Dict[str, Any]]:
+    def get_models() -> Mapping[str, ModelSpec]:
         """Get available models configuration."""
-        models = {
-            "TinyLlama-Chat": {
-                "name": "PY007/TinyLlama-1.1B-Chat-v0.3",
-                "description": "Fast and efficient chat model",
-                "context_length": 512,
-                "size": "small",
-                "api": False
-            },
-            "Phi-2": {
-                "name": "susnato/phi-2",
-                "description": "Good performance and speed",
-                "context_length": 512,
-                "size": "small",
-                "api": False
-            }
-        }
-        
-        # Add Groq models if API key is available
-        if GROQ_API_KEY:
-            models.update({
-                "Groq-LLaMA3-8B": {
-                    "name": "llama3-8b-8192",
-                    "description": "Fast LLaMA3 8B model",
-                    "context_length": 8192,
-                    "size": "medium",
-                    "api": "groq"
-                },
-                "Groq-Mixtral-8x7B": {
-                    "name": "mixtral-8x7b-32768",
-                    "description": "Powerful Mixtral 8x7B model",
-                    "context_length": 32768,
-                    "size": "large",
-                    "api": "groq"
-                },
-                "Groq-Claude-3-Opus": {
-                    "name": "claude-3-opus-20240229",
-                    "description": "High-quality Claude 3 Opus model",
-                    "context_length": 8192,
-                    "size": "xlarge",
-                    "api": "groq"
-                },
-                "Groq-Gemma-7B": {
-                    "name": "gemma-7b-it",
-                    "description": "Google's Gemma 7B model",
-                    "context_length": 8192,
-                    "size": "medium",
-                    "api": "groq"
-                }
-            })
-        
-        return models
+        return _MODELS
     
     @staticmethod
-    def get_personalities() -> Dict[str, Dict[str, str]]:
+    def get_personalities() -> Mapping[str, Mapping[str, str]]:
         """Get available personality configurations."""
-        return {
-            "friendly": {
-                "name": "Friendly",
-                "description": "Warm and conversational",
-                "prompt": "You are a friendly and helpful mental health AI assistant. Express yourself in a warm and approachable way while maintaining accuracy. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            },
-            "professional": {
-                "name": "Professional",
-                "description": "Direct and clear",
-                "prompt": "You are a professional mental health AI assistant. Be direct and clear in your responses. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            },
-            "therapeutic": {
-                "name": "Therapeutic",
-                "description": "Supportive and empathetic",
-                "prompt": "You are a therapeutic mental health AI assistant focused on providing emotional support. Respond with empathy and understanding while offering constructive guidance. IMPORTANT: You have memory of the entire conversation history provided to you. You should acknowledge and remember details shared by the user throughout the conversation. Never claim that you don't remember previous parts of the conversation or that each interaction is new. Maintain context and continuity throughout the conversation."
-            }
-        }
+        return _PERSONALITIES
+    
+    @staticmethod
+    def get_model_options() -> Tuple[Tuple[str, ...], Mapping[str, int]]:
+        """Get model keys in display order and a key -> position lookup."""
+        return _MODEL_KEYS, _MODEL_INDEX
+    
+    @staticmethod
+    def get_personality_options() -> Tuple[Tuple[str, ...], Mapping[str, int]]:
+        """Get personality keys in display order and a key -> position lookup."""
+        return _PERSONALITY_KEYS, _PERSONALITY_INDEX
+    
+    @staticmethod
+    def get_model_labels() -> Mapping[str, str]:
+        """Get "key - description" display labels for models."""
+        return _MODEL_LABELS
     
     @staticmethod
-    def get_current_model() -> Dict[str, Any]:
+    def get_personality_labels() -> Mapping[str, str]:
+        """Get "name - description" display labels for personalities."""
+        return _PERSONALITY_LABELS
+    
+    @staticmethod
+    def get_personality_names() -> Mapping[str, str]:
+        """Get display names for personalities."""
+        return _PERSONALITY_NAMES
+    
+    @staticmethod
+    def get_current_model() -> ModelSpec:
         """Get current model configuration."""
         models = StateManager.get_models()
         selected_model = st.session_state.selected_model
@@ -200,7 +276,7 @@ class StateManager:
         return prompt
     
     @staticmethod
-    def get_current_personality() -> Dict[str, str]:
+    def get_current_personality() -> Mapping[str, str]:
         """Get the currently selected personality configuration."""
         personalities = StateManager.get_personalities()
         personality = st.session_state.personality
@@ -209,20 +285,34 @@ class StateManager:
             personality = next(iter(personalities))
             st.session_state.personality = personality
         
+        # Reuse the resolved personality until the selection or a prompt edit changes it
+        cache_key = (personality, st.session_state.get("personality_prompt_version", 0))
+        if st.session_state.get("_personality_cache_key") == cache_key:
+            return st.session_state._resolved_personality
+        
         # Get personality prompt from database if available
         prompt_name = f"personality_{personality}"
         db_prompt = database.get_prompt(prompt_name)
         
         if db_prompt:
             # Use the prompt from database
-            return {
+            resolved = {
                 "name": personalities[personality]["name"],
                 "description": personalities[personality]["description"],
                 "prompt": db_prompt["content"]
             }
+        else:
+            # Fallback to hardcoded prompt
+            resolved = personalities[personality]
         
-        # Fallback to hardcoded prompt
-        return personalities[personality]
+        st.session_state._personality_cache_key = cache_key
+        st.session_state._resolved_personality = resolved
+        return resolved
+    
+    @staticmethod
+    def invalidate_personality_cache() -> None:
+        """Force the next get_current_personality call to re-read prompts from the database."""
+        st.session_state.personality_prompt_version = st.session_state.get("personality_prompt_version", 0) + 1
     
     @staticmethod
     def get_api_key(provider: str) -> Optional[str]:
@@ -238,6 +328,17 @@ class StateManager:
             st.session_state.chat_history = []
         st.session_state.chat_history.append(message)
     
+    @staticmethod
+    def update_sentiment_history(sentiment_info: Dict[str, Any]) -> None:
+        """Append a sentiment entry, keeping only a bounded recent window in session.
+
+        Persisting the entry is the caller's job (see database.enqueue_sentiment).
+        """
+        history = st.session_state.sentiment_history
+        history.append(sentiment_info)
+        if len(history) > SENTIMENT_HISTORY_LIMIT:
+            del history[:-SENTIMENT_HISTORY_LIMIT]
+    
     @staticmethod
     def clear_chat_history() -> None:
         """Clear current chat history."""